@@ -0,0 +1,359 @@
+"""
+Shared die-yield simulation core used by both Streamlit apps (app.py and v1/app.py):
+geometry and classification, the Monte Carlo defect simulation, and die map rendering.
+All Streamlit caching lives here so both apps share it.
+"""
+import streamlit as st
+import numpy as np
+import matplotlib
+matplotlib.use("Agg")  # Render off-screen; figures are only ever saved to PNG
+import matplotlib.pyplot as plt
+from matplotlib.collections import LineCollection
+from matplotlib.colors import to_rgba_array
+from numpy.random import default_rng
+import math
+from io import BytesIO
+
+try:
+    from numba import config as numba_config, njit, prange
+    HAS_NUMBA = True
+except ImportError:  # Numba is optional; classification falls back to NumPy
+    HAS_NUMBA = False
+
+# ============================
+# Die Status Codes
+# ============================
+
+# Dice are stored as parallel arrays; each die's status is one of these uint8 codes.
+STATUS_PENDING = 0
+STATUS_GOOD_PHYSICAL = 1
+STATUS_PARTIAL = 2
+STATUS_LOST = 3
+STATUS_GOOD = 4
+STATUS_DEFECTIVE = 5
+
+# Die map colors: Good = green, Defective = red, Partial = yellow, Lost = grey.
+STATUS_COLORS = {
+    STATUS_PENDING: "blue",
+    STATUS_GOOD_PHYSICAL: "blue",
+    STATUS_PARTIAL: "yellow",
+    STATUS_LOST: "grey",
+    STATUS_GOOD: "green",
+    STATUS_DEFECTIVE: "red",
+}
+# The same colors as a uint8 RGBA lookup table indexed by status code (half transparent).
+STATUS_RGBA = (to_rgba_array([STATUS_COLORS[code] for code in sorted(STATUS_COLORS)], alpha=0.5) * 255).astype(np.uint8)
+
+# Upper bound on random numbers drawn at once by the Monte Carlo simulation (64 MB of float32)
+MAX_MC_DRAWS = 16_000_000
+
+# Die count above which classification uses the Numba kernel (when Numba is installed)
+NUMBA_MIN_DICE = 200_000
+
+# ============================
+# Utility Functions
+# ============================
+
+def is_inside_wafer(x, y, effective_radius):
+    """
+    Return True if (x, y) lies within a circle of radius effective_radius.
+    Single-point check; classify_dice tests all dice against a precomputed squared radius.
+    """
+    return (x**2 + y**2) <= effective_radius**2
+
+def is_inside_panel(x, y, panel_width, panel_height, margin):
+    """
+    Return True if (x, y) lies inside the effective panel area (panel minus margin).
+    Single-point check; classify_dice tests all dice against precomputed panel bounds.
+    """
+    return (x >= margin) and (x <= panel_width - margin) and (y >= margin) and (y <= panel_height - margin)
+
+def compute_yield_fraction(defect_rate, critical_area, model):
+    """
+    Compute the yield fraction using the specified model.
+    The defect parameter D is computed as:
+    
+      D = defect_rate * (critical_area_in_cm2)
+    
+    where critical_area (mm²) is converted to cm² by dividing by 100.
+    """
+    D = defect_rate * (critical_area / 100.0)
+    if model == "Poisson":
+        return math.exp(-D)
+    elif model == "Murphy":
+        return ((1 - math.exp(-D)) / D)**2 if D != 0 else 1.0
+    elif model == "Rectangular":
+        return (1 - math.exp(-2 * D)) / (2 * D) if D != 0 else 1.0
+    elif model == "Moore":
+        return math.exp(-math.sqrt(D))
+    elif model == "Seeds":
+        return 1 / (1 + D)
+    else:
+        return math.exp(-D)
+
+# -----------------------------
+# Geometry Calculation
+# -----------------------------
+def compute_geometry(substrate_type, substrate_params, shot_width, shot_height, die_width, die_height, scribe_x, scribe_y):
+    """
+    Compute the grid of die positions (their lower-left corners) across all
+    reticle shots.
+    
+    Returns the dice as a dictionary of arrays, one element per die:
+      {
+         "x": <die lower-left x>,  # float32
+         "y": <die lower-left y>,  # float32
+         "status": STATUS_PENDING  # classification later
+      }
+    """
+    if substrate_type == "Wafer":
+        radius = substrate_params["radius"]
+        shot_x_positions = np.arange(-radius, radius, shot_width)
+        shot_y_positions = np.arange(-radius, radius, shot_height)
+    else:  # Panel
+        panel_width = substrate_params["panel_width"]
+        panel_height = substrate_params["panel_height"]
+        shot_x_positions = np.arange(0, panel_width, shot_width)
+        shot_y_positions = np.arange(0, panel_height, shot_height)
+    
+    # Determine the die pitch and number of dice per shot (using integer division)
+    pitch_x = die_width + scribe_x
+    pitch_y = die_height + scribe_y
+    num_dice_x = int((shot_width + scribe_x) // pitch_x)
+    num_dice_y = int((shot_height + scribe_y) // pitch_y)
+    
+    # Die offsets inside every shot, flattened into one coordinate axis per direction
+    die_xs = (shot_x_positions[:, None] + np.arange(num_dice_x)[None, :] * pitch_x).ravel()
+    die_ys = (shot_y_positions[:, None] + np.arange(num_dice_y)[None, :] * pitch_y).ravel()
+    die_x, die_y = np.meshgrid(die_xs, die_ys, indexing="ij")
+    return {
+        "x": die_x.ravel().astype(np.float32),
+        "y": die_y.ravel().astype(np.float32),
+        "status": np.full(die_x.size, STATUS_PENDING, dtype=np.uint8)
+    }
+
+if HAS_NUMBA:
+    @njit(parallel=True, cache=True)
+    def _classify_dice_nb(x, y, corner_dx, corner_dy, is_wafer, r2, xmin, xmax, ymin, ymax, out):
+        """Corner test and classification fused into one parallel pass over the dice."""
+        for i in prange(x.size):
+            inside_count = 0
+            for k in range(4):
+                cx = x[i] + corner_dx[k]
+                cy = y[i] + corner_dy[k]
+                if is_wafer:
+                    inside = cx * cx + cy * cy <= r2
+                else:
+                    inside = cx >= xmin and cx <= xmax and cy >= ymin and cy <= ymax
+                if inside:
+                    inside_count += 1
+            if inside_count == 4:
+                out[i] = STATUS_GOOD_PHYSICAL
+            elif inside_count > 0:
+                out[i] = STATUS_PARTIAL
+            else:
+                out[i] = STATUS_LOST
+
+    def _run_classify_kernel(*args):
+        """Run _classify_dice_nb, preferring the OpenMP threading layer for its first launch."""
+        # Streamlit runs the script in worker threads; the TBB layer hangs interpreter exit
+        # when first launched off the main thread. Numba picks the layer on the first parallel
+        # launch, so only that call needs the override and the global setting is restored.
+        priority = numba_config.THREADING_LAYER_PRIORITY
+        numba_config.THREADING_LAYER_PRIORITY = ["omp", "tbb", "workqueue"]
+        try:
+            _classify_dice_nb(*args)
+        finally:
+            numba_config.THREADING_LAYER_PRIORITY = priority
+
+def classify_dice(x, y, die_width, die_height, substrate_type, substrate_params, accelerate=False):
+    """
+    Classify all dice at once based on how many of their corners lie inside the
+    substrate's effective area. Returns a status array aligned with x and y.
+    
+    Large grids (or accelerate=True) use the parallel Numba kernel when Numba is installed,
+    which avoids the (N, 4) corner temporaries of the NumPy path.
+    """
+    # Keep every comparison in float32 like the coordinates (halves the memory traffic).
+    # Both paths add the same corner offsets: lower-left, lower-right, upper-left, upper-right.
+    corner_dx = np.array([0, die_width, 0, die_width], dtype=np.float32)
+    corner_dy = np.array([0, 0, die_height, die_height], dtype=np.float32)
+    
+    # Evaluate the substrate bounds once: squared radius for wafers, effective
+    # rectangle for panels (the unused ones are zero)
+    is_wafer = substrate_type == "Wafer"
+    r2 = xmin = xmax = ymin = ymax = np.float32(0)
+    if is_wafer:
+        effective_radius = np.float32(substrate_params["effective_radius"])
+        r2 = effective_radius * effective_radius
+    else:
+        margin = substrate_params["edge_loss"]
+        xmin, xmax = np.float32(margin), np.float32(substrate_params["panel_width"] - margin)
+        ymin, ymax = np.float32(margin), np.float32(substrate_params["panel_height"] - margin)
+    
+    if HAS_NUMBA and (accelerate or x.size > NUMBA_MIN_DICE):
+        status = np.empty(x.size, dtype=np.uint8)
+        _run_classify_kernel(x, y, corner_dx, corner_dy, is_wafer, r2, xmin, xmax, ymin, ymax, status)
+        return status
+    
+    # Corner coordinates as (N, 4) arrays
+    cx = x[:, None] + corner_dx
+    cy = y[:, None] + corner_dy
+    if is_wafer:
+        inside = cx * cx + cy * cy <= r2
+    else:
+        inside = (cx >= xmin) & (cx <= xmax) & (cy >= ymin) & (cy <= ymax)
+    inside_count = inside.sum(axis=1)
+    status = np.full(x.size, STATUS_LOST, dtype=np.uint8)
+    status[inside_count > 0] = STATUS_PARTIAL
+    status[inside_count == 4] = STATUS_GOOD_PHYSICAL
+    return status
+
+# -----------------------------
+# Cached Classification
+# -----------------------------
+@st.cache_data(show_spinner=False)
+def compute_classified(substrate_type, substrate_params, shot_width, shot_height, die_width, die_height, scribe_x, scribe_y,
+                       _accelerate=False):
+    """
+    Compute the die grid and classify every die against the substrate.
+    Both stages are deterministic in the inputs, so pressing "Run Simulation" again
+    with unchanged geometry only re-runs the Monte Carlo defect draws.
+    _accelerate is left out of the cache key: both classification paths give identical results.
+    
+    Returns (x, y, phys_status) arrays, one element per die.
+    """
+    dice = compute_geometry(substrate_type, substrate_params, shot_width, shot_height, die_width, die_height, scribe_x, scribe_y)
+    phys_status = classify_dice(dice["x"], dice["y"], die_width, die_height, substrate_type, substrate_params,
+                                accelerate=_accelerate)
+    return dice["x"], dice["y"], phys_status
+
+# -----------------------------
+# Monte Carlo Simulation
+# -----------------------------
+def run_monte_carlo(sim_runs, phys_status, yield_fraction, random_seed):
+    """
+    Run the defect injection simulation multiple times (Monte Carlo) and return aggregated results.
+    
+    Classification is deterministic in the geometry, so phys_status comes precomputed from
+    compute_classified. All runs are drawn together as a (sim_runs, good_physical) random matrix and tallied
+    with one reduction; "good", "defective" and "fab_yield" are arrays with one entry per run.
+    The per-die status array is only materialized for the first run, which is the one displayed.
+    """
+    # Tally every status class in a single pass over the classification
+    phys_counts = np.bincount(phys_status, minlength=len(STATUS_COLORS))
+    good_phys_idx = np.flatnonzero(phys_status == STATUS_GOOD_PHYSICAL)
+    num_good_physical = good_phys_idx.size
+    good_per_run = np.empty(sim_runs, dtype=np.int32)
+    
+    # Draw whole blocks of runs at once, bounding the random matrix for very large grids.
+    # Each block is reduced straight to per-run good counts; no per-die status is written
+    # except for the first run. The draw and mask buffers are reused across blocks.
+    rng = default_rng(random_seed)
+    runs_per_block = min(sim_runs, max(1, MAX_MC_DRAWS // max(num_good_physical, 1)))
+    draws = np.empty((runs_per_block, num_good_physical), dtype=np.float32)
+    good_mask = np.empty(draws.shape, dtype=bool)
+    for start in range(0, sim_runs, runs_per_block):
+        block = min(runs_per_block, sim_runs - start)
+        rng.random(dtype=np.float32, out=draws[:block])
+        np.less(draws[:block], yield_fraction, out=good_mask[:block])
+        good_per_run[start:start + block] = good_mask[:block].sum(axis=1, dtype=np.int32)
+        if start == 0:
+            first_run_good = good_mask[0].copy()
+    defective_per_run = num_good_physical - good_per_run
+    fab_yield = good_per_run / num_good_physical if num_good_physical > 0 else np.zeros(sim_runs)
+    
+    status = phys_status.copy()
+    status[good_phys_idx] = np.where(first_run_good, STATUS_GOOD, STATUS_DEFECTIVE)
+    return {
+        "total": phys_status.size,
+        "good_physical": num_good_physical,
+        "good": good_per_run,
+        "defective": defective_per_run,
+        "partial": int(phys_counts[STATUS_PARTIAL]),
+        "lost": int(phys_counts[STATUS_LOST]),
+        "fab_yield": fab_yield,
+        "status": status
+    }
+
+# -----------------------------
+# Plotting
+# -----------------------------
+def draw_die_map(ax, x, y, status, die_width, die_height):
+    """
+    Draw the dice onto ax as a single RGBA raster colored by status.
+    
+    x and y come from compute_geometry, so the dice form a regular grid (in "ij" order)
+    with gaps for scribe lines and shot borders. Cell edges alternate die start / die end,
+    so only the even cells hold dice and the gap cells stay transparent.
+    """
+    if x.size == 0:
+        return
+    num_rows = int(np.count_nonzero(x == x[0]))  # dice sharing the first column
+    die_xs, die_ys = x[::num_rows], y[:num_rows]
+    x_edges = np.column_stack([die_xs, die_xs + die_width]).ravel()
+    y_edges = np.column_stack([die_ys, die_ys + die_height]).ravel()
+    rgba = np.zeros((y_edges.size - 1, x_edges.size - 1, 4), dtype=np.uint8)
+    rgba[::2, ::2] = STATUS_RGBA[status.reshape(die_xs.size, die_ys.size).T]
+    ax.pcolormesh(x_edges, y_edges, rgba)
+
+@st.cache_data(show_spinner=False, max_entries=16)  # Every new seed or run adds a PNG; keep only recent ones
+def render_die_map(status_bytes, x, y, die_width, die_height, substrate_type, substrate_params,
+                   show_shots=False, shot_width=None, shot_height=None):
+    """
+    Render the full die map figure and return it as PNG bytes.
+    
+    The per-die status is passed as raw bytes so it is hashed in full; reruns with the same
+    simulation result (e.g. after editing an unrelated widget) reuse the cached PNG.
+    """
+    fig, ax = plt.subplots(figsize=(8, 8))
+    
+    # Draw substrate boundary
+    if substrate_type == "Wafer":
+        circle = plt.Circle((0, 0), substrate_params["effective_radius"], color='black', 
+                            fill=False, linestyle='--', label="Wafer Boundary")
+        ax.add_artist(circle)
+    else:
+        rect = plt.Rectangle((substrate_params["edge_loss"], substrate_params["edge_loss"]),
+                             substrate_params["panel_width"] - 2 * substrate_params["edge_loss"],
+                             substrate_params["panel_height"] - 2 * substrate_params["edge_loss"],
+                             edgecolor='black', facecolor='none', linestyle='--', label="Panel Effective Area")
+        ax.add_artist(rect)
+    
+    # Optionally, draw reticle shot boundaries
+    if show_shots:
+        if substrate_type == "Wafer":
+            radius = substrate_params["radius"]
+            shot_x_positions = np.arange(-radius, radius, shot_width)
+            shot_y_positions = np.arange(-radius, radius, shot_height)
+        else:
+            shot_x_positions = np.arange(0, substrate_params["panel_width"], shot_width)
+            shot_y_positions = np.arange(0, substrate_params["panel_height"], shot_height)
+        # Shot edges as one collection of vertical and one of horizontal lines
+        line_xs = shot_x_positions[0] + shot_width * np.arange(len(shot_x_positions) + 1)
+        line_ys = shot_y_positions[0] + shot_height * np.arange(len(shot_y_positions) + 1)
+        vlines = np.stack([np.column_stack([line_xs, np.full(line_xs.size, line_ys[0])]),
+                           np.column_stack([line_xs, np.full(line_xs.size, line_ys[-1])])], axis=1)
+        hlines = np.stack([np.column_stack([np.full(line_ys.size, line_xs[0]), line_ys]),
+                           np.column_stack([np.full(line_ys.size, line_xs[-1]), line_ys])], axis=1)
+        for lines in (vlines, hlines):
+            ax.add_collection(LineCollection(lines, colors='blue', linestyles=':', alpha=0.3))
+    
+    # Draw all dice as one raster, colored by status.
+    draw_die_map(ax, x, y, np.frombuffer(status_bytes, dtype=np.uint8), die_width, die_height)
+    
+    ax.set_aspect('equal')
+    if substrate_type == "Wafer":
+        ax.set_xlim(-substrate_params["radius"], substrate_params["radius"])
+        ax.set_ylim(-substrate_params["radius"], substrate_params["radius"])
+        ax.set_title("Die Map on Wafer")
+    else:
+        ax.set_xlim(0, substrate_params["panel_width"])
+        ax.set_ylim(0, substrate_params["panel_height"])
+        ax.set_title("Die Map on Panel")
+    
+    # Rasterize once straight into the buffer and free the figure
+    buf = BytesIO()
+    fig.savefig(buf, format="png", dpi=100, bbox_inches="tight")
+    plt.close(fig)
+    return buf.getvalue()
@@ -1,46 +1,11 @@
-import streamlit as st
-import numpy as np
-import matplotlib.pyplot as plt
-import math
-import random
-
-# ============================
-# Utility functions
-# ============================
-
-def is_inside_wafer(x, y, effective_radius):
-    """Check if a point (x,y) is within a circle of radius effective_radius."""
-    return (x**2 + y**2) <= effective_radius**2
+import os
+import sys
 
-def is_inside_panel(x, y, panel_width, panel_height, margin):
-    """
-    Check if a point (x,y) is inside the effective rectangular area of a panel.
-    The effective area is defined as the full panel minus an edge-loss margin.
-    """
-    return (x >= margin) and (x <= panel_width - margin) and (y >= margin) and (y <= panel_height - margin)
+import streamlit as st
 
-def compute_yield_fraction(defect_rate, critical_area, model):
-    """
-    Compute the yield fraction using the specified model.
-    The defect parameter D is computed as:
-    
-        D = defect_rate * (critical_area_in_cm2)
-    
-    where critical_area (input in mm²) is converted to cm² by dividing by 100.
-    """
-    D = defect_rate * (critical_area / 100)  # convert mm² to cm²
-    if model == "Poisson":
-        return math.exp(-D)
-    elif model == "Murphy":
-        return ((1 - math.exp(-D)) / D)**2 if D != 0 else 1.0
-    elif model == "Rectangular":
-        return (1 - math.exp(-2 * D)) / (2 * D) if D != 0 else 1.0
-    elif model == "Moore":
-        return math.exp(-math.sqrt(D))
-    elif model == "Seeds":
-        return 1 / (1 + D)
-    else:
-        return math.exp(-D)
+# The shared simulation core lives in the repository root, next to the main app.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from die_yield_core import compute_classified, compute_yield_fraction, render_die_map, run_monte_carlo
 
 # ============================
 # Main App Function
@@ -70,10 +35,12 @@ def main():
         edge_loss = st.sidebar.number_input("Edge Loss (mm)", value=0.0, step=0.5)
         radius = wafer_diameter / 2
         effective_radius = radius - edge_loss
+        substrate_params = {"radius": radius, "effective_radius": effective_radius}
     else:
         panel_width = st.sidebar.number_input("Panel Width (mm)", value=1000.0, step=10.0)
         panel_height = st.sidebar.number_input("Panel Height (mm)", value=500.0, step=10.0)
         edge_loss = st.sidebar.number_input("Edge Loss Margin (mm)", value=0.0, step=0.5)
+        substrate_params = {"panel_width": panel_width, "panel_height": panel_height, "edge_loss": edge_loss}
     
     # --------------------------
     # Sidebar: Reticle Shot Settings
@@ -109,146 +76,36 @@ def main():
         yld_fraction = compute_yield_fraction(defect_rate, critical_area, yield_model)
         
         # --------------------------
-        # 2. Build the Die Grid over All Reticle Shots
+        # 2. Build the Die Grid over All Reticle Shots and Classify Each Die
         # --------------------------
-        dice_list = []  # Each entry will be a dict with die position and status
-        
-        # For wafer: build a grid that covers the wafer's bounding box.
-        # For panel: grid covers the full panel.
-        if substrate_type == "Wafer":
-            shot_x_positions = np.arange(-radius, radius, shot_width)
-            shot_y_positions = np.arange(-radius, radius, shot_height)
-        else:
-            shot_x_positions = np.arange(0, panel_width, shot_width)
-            shot_y_positions = np.arange(0, panel_height, shot_height)
-        
-        # Loop over each reticle shot
-        for shot_x in shot_x_positions:
-            for shot_y in shot_y_positions:
-                # Compute how many dice fit horizontally and vertically in this shot.
-                # (The scribe line is added to the die pitch.)
-                num_dice_x = int((shot_width + scribe_x) // (die_width + scribe_x))
-                num_dice_y = int((shot_height + scribe_y) // (die_height + scribe_y))
-                
-                # Place dice in a grid within the shot
-                for i in range(num_dice_x):
-                    for j in range(num_dice_y):
-                        die_x = shot_x + i * (die_width + scribe_x)
-                        die_y = shot_y + j * (die_height + scribe_y)
-                        
-                        # Define the four corners of the die rectangle.
-                        corners = [
-                            (die_x, die_y),
-                            (die_x + die_width, die_y),
-                            (die_x, die_y + die_height),
-                            (die_x + die_width, die_y + die_height)
-                        ]
-                        
-                        # Count how many corners lie within the substrate's effective region.
-                        inside_count = 0
-                        for (cx, cy) in corners:
-                            if substrate_type == "Wafer":
-                                if is_inside_wafer(cx, cy, effective_radius):
-                                    inside_count += 1
-                            else:  # Panel
-                                if is_inside_panel(cx, cy, panel_width, panel_height, edge_loss):
-                                    inside_count += 1
-                        
-                        # Classify the die based on how many corners are inside.
-                        if inside_count == 4:
-                            status = "good_physical"  # candidate for yield injection
-                        elif inside_count > 0:
-                            status = "partial"
-                        else:
-                            status = "lost"
-                        
-                        dice_list.append({
-                            "x": die_x,
-                            "y": die_y,
-                            "status": status
-                        })
+        # Each die's corners are checked against the substrate boundary (or effective area).
+        # Geometry and classification are cached in the shared core.
+        dice_x, dice_y, phys_status = compute_classified(substrate_type, substrate_params, shot_width, shot_height,
+                                                         die_width, die_height, scribe_x, scribe_y)
         
         # --------------------------
         # 3. Defect Injection on Physically Good Dice
         # --------------------------
-        # For dice that are fully inside, randomly mark some as defective.
-        good_physical_indices = [idx for idx, d in enumerate(dice_list) if d["status"] == "good_physical"]
-        num_good_physical = len(good_physical_indices)
-        
-        for idx in good_physical_indices:
-            if random.random() < yld_fraction:
-                dice_list[idx]["status"] = "good"
-            else:
-                dice_list[idx]["status"] = "defective"
+        # A single (unseeded) run: physically good dice are randomly marked good or defective.
+        sim = run_monte_carlo(1, phys_status, yld_fraction, None)
         
         # --------------------------
         # 4. Tally the Results
         # --------------------------
-        count_good = sum(1 for d in dice_list if d["status"] == "good")
-        count_defective = sum(1 for d in dice_list if d["status"] == "defective")
-        count_partial = sum(1 for d in dice_list if d["status"] == "partial")
-        count_lost = sum(1 for d in dice_list if d["status"] == "lost")
-        total_dice = len(dice_list)
-        
-        # Compute fab yield: good dice divided by the total of physically good dice
-        fab_yield = (count_good / (count_good + count_defective)) if (count_good + count_defective) > 0 else 0
-        
         st.subheader("Results Summary")
-        st.write(f"**Total Dice (all shots):** {total_dice}")
-        st.write(f"**Physically Good Dice (before defect injection):** {num_good_physical}")
-        st.write(f"**Good Dice (after defect injection):** {count_good}")
-        st.write(f"**Defective Dice:** {count_defective}")
-        st.write(f"**Partial Dice:** {count_partial}")
-        st.write(f"**Lost Dice:** {count_lost}")
-        st.write(f"**Fab Yield (Good/(Good+Defective)):** {fab_yield:.2%}")
+        st.write(f"**Total Dice (all shots):** {sim['total']}")
+        st.write(f"**Physically Good Dice (before defect injection):** {sim['good_physical']}")
+        st.write(f"**Good Dice (after defect injection):** {sim['good'][0]}")
+        st.write(f"**Defective Dice:** {sim['defective'][0]}")
+        st.write(f"**Partial Dice:** {sim['partial']}")
+        st.write(f"**Lost Dice:** {sim['lost']}")
+        st.write(f"**Fab Yield (Good/(Good+Defective)):** {sim['fab_yield'][0]:.2%}")
         
         # --------------------------
         # 5. Plot the Die Map
         # --------------------------
-        fig, ax = plt.subplots()
-        
-        # Draw substrate boundary.
-        if substrate_type == "Wafer":
-            # The effective wafer is drawn as a dashed circle.
-            circle = plt.Circle((0, 0), effective_radius, color='black', fill=False, linestyle='--')
-            ax.add_artist(circle)
-        else:
-            # Draw the effective panel area (inner rectangle after edge loss).
-            rect = plt.Rectangle((edge_loss, edge_loss),
-                                 panel_width - 2 * edge_loss,
-                                 panel_height - 2 * edge_loss,
-                                 edgecolor='black', facecolor='none', linestyle='--')
-            ax.add_artist(rect)
-        
-        # Draw each die as a colored rectangle.
-        # Colors: Good = green, Defective = red, Partial = yellow, Lost = grey.
-        for d in dice_list:
-            if d["status"] == "good":
-                color = "green"
-            elif d["status"] == "defective":
-                color = "red"
-            elif d["status"] == "partial":
-                color = "yellow"
-            elif d["status"] == "lost":
-                color = "grey"
-            else:
-                color = "blue"
-            
-            rect = plt.Rectangle((d["x"], d["y"]), die_width, die_height,
-                                 edgecolor=color, facecolor=color, alpha=0.5)
-            ax.add_patch(rect)
-        
-        ax.set_aspect('equal')
-        if substrate_type == "Wafer":
-            ax.set_xlim(-radius, radius)
-            ax.set_ylim(-radius, radius)
-            ax.set_title("Die Map on Wafer")
-        else:
-            ax.set_xlim(0, panel_width)
-            ax.set_ylim(0, panel_height)
-            ax.set_title("Die Map on Panel")
-        
-        st.pyplot(fig)
+        st.image(render_die_map(sim["status"].tobytes(), dice_x, dice_y, die_width, die_height,
+                                substrate_type, substrate_params, show_shots=False))
 
 if __name__ == "__main__":
     main()